@@ -13,36 +13,169 @@ Output:
     Multi:  Saves per-trajectory stats + overall_django_results.txt in parent dir
 """
 import json
+import math
+import mmap
+import os
 import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-import statistics
 
-METRICS = ["correctness", "completeness", "relevance", "clarity", "reasoning", "total_score"]
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
+try:
+    from simdjson import Parser as _SimdParser
+except ImportError:
+    _SimdParser = None
+
+METRICS = ("correctness", "completeness", "relevance", "clarity", "reasoning", "total_score")
+# Raw forms of an empty answer, as written by compact and default JSON encoders
+EMPTY_ANSWER_MARKERS = (b'"candidate_answer":""', b'"candidate_answer": ""')
+# Bump when the stats dict layout changes so stale .stats.json caches are ignored
+CACHE_VERSION = 2
+
+
+def iter_lines(jsonl_file: Path):
+    """Yield non-empty raw lines from a JSONL file through a read-only memory map."""
+    with open(jsonl_file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return  # Empty files cannot be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            while line := mm.readline():
+                if line.strip():
+                    yield line
+
+
+def make_extractor(keys: tuple):
+    """Compile a function returning the values of `keys` from a record, None if missing.
+
+    The keys are fixed at module load, so the lookups are spelled out as
+    constants instead of looping over the key tuple for every record.
+    """
+    getters = ", ".join(f"get({k!r})" for k in keys)
+    source = f"def extract(record):\n    get = record.get\n    return ({getters},)\n"
+    namespace = {}
+    exec(source, namespace)
+    return namespace["extract"]
+
+
+extract_metrics = make_extractor(METRICS)
+
+
+def record_reader():
+    """Return a function mapping a raw line to its metric values, or None if the answer is blank.
+
+    Uses simdjson when installed, which reads just the needed fields lazily
+    instead of building a dict for the whole record.
+    """
+    load = _SimdParser().parse if _SimdParser is not None else _loads
+
+    def decode(line: bytes):
+        # A simdjson document borrows the parser's buffer, so it must not outlive this call
+        record = load(line)
+        answer = record.get("candidate_answer")
+        # isspace() tests for a blank answer without allocating a stripped copy
+        if not answer or answer.isspace():
+            return None
+        return extract_metrics(record)
+
+    return decode
+
+
+def moment_stats(n: int, mean: float, m2: float) -> dict:
+    """Stats entry for a metric from its count, mean and sum of squared deviations.
+
+    Keeping (n, mean, M2) lets entries from several files be pooled without
+    the cancellation a raw sum of squares suffers on large offsets.
+    """
+    var = m2 / (n - 1) if n > 1 else 0.0
+    return {
+        "n": n,
+        "mean": mean,
+        "m2": m2,
+        "std": math.sqrt(var)
+    }
+
+
+def column_stats(vals) -> dict:
+    """Stats entry for a non-empty column of metric values, computed in two passes."""
+    n = len(vals)
+    mean = math.fsum(vals) / n
+    return moment_stats(n, mean, math.fsum((v - mean) ** 2 for v in vals))
+
+
+def combine_moments(acc: list, entry: dict):
+    """Fold a stats entry into an [n, mean, M2] accumulator (Chan et al.)."""
+    n_a, mean_a, m2_a = acc
+    n_b, mean_b, m2_b = entry["n"], entry["mean"], entry["m2"]
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    acc[0] = n
+    acc[1] = mean_a + delta * n_b / n
+    acc[2] = m2_a + m2_b + delta * delta * n_a * n_b / n
 
 
 def aggregate_single_file(jsonl_file: Path) -> dict:
-    """Aggregate scores from a single JSONL file. Returns stats dict."""
-    all_scores = {m: [] for m in METRICS}
+    """Aggregate scores from a single JSONL file. Returns stats dict.
+
+    Results are cached in a sibling {repo}.stats.json and reused while the
+    JSONL file keeps the same size and modification time.
+    """
+    cache_file = jsonl_file.with_suffix(".stats.json")
+    st = jsonl_file.stat()
+    key = [CACHE_VERSION, st.st_size, st.st_mtime_ns]
+
+    try:
+        cached = _loads(cache_file.read_bytes())
+        if cached["key"] == key:
+            return cached["stats"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    stats = compute_file_stats(jsonl_file)
+    try:
+        cache_file.write_text(json.dumps({"key": key, "stats": stats}))
+    except OSError:
+        pass  # Caching is best-effort, e.g. on read-only datasets
+    return stats
+
+
+def compute_file_stats(jsonl_file: Path) -> dict:
+    """Parse a JSONL score file and compute its stats dict."""
+    # One packed float column per metric, in METRICS order; the statistics
+    # are reduced column by column once the file is read
+    columns = [array("d") for _ in METRICS]
+    read_record = record_reader()
     empty_answers = 0
     total_records = 0
 
-    with open(jsonl_file) as f:
-        for line in f:
-            record = json.loads(line)
-            total_records += 1
-
-            # Check if answer is empty (agent didn't submit in time)
-            # Note: scorer uses "candidate_answer" field
-            answer = record.get("candidate_answer", "").strip()
-            if not answer:
-                empty_answers += 1
-                # Count as 0 for all metrics
-                for m in METRICS:
-                    all_scores[m].append(0)
-            else:
-                for m in METRICS:
-                    if m in record:
-                        all_scores[m].append(record[m])
+    for line in iter_lines(jsonl_file):
+        total_records += 1
+
+        # Check if answer is empty (agent didn't submit in time)
+        # Note: scorer uses "candidate_answer" field
+        # A literal empty answer is caught on the raw bytes, skipping the decode
+        if EMPTY_ANSWER_MARKERS[0] in line or EMPTY_ANSWER_MARKERS[1] in line:
+            empty_answers += 1
+            for column in columns:
+                column.append(0.0)
+            continue
+
+        values = read_record(line)
+        if values is None:
+            empty_answers += 1
+            # Count as 0 for all metrics
+            for column in columns:
+                column.append(0.0)
+        else:
+            for column, v in zip(columns, values):
+                if v is not None:
+                    column.append(v)
 
     # Compute stats
     stats = {
@@ -50,13 +183,9 @@ def aggregate_single_file(jsonl_file: Path) -> dict:
         "empty_answers": empty_answers,
         "metrics": {}
     }
-    for m in METRICS:
-        vals = all_scores[m]
-        if vals:
-            stats["metrics"][m] = {
-                "mean": statistics.mean(vals),
-                "std": statistics.stdev(vals) if len(vals) > 1 else 0.0
-            }
+    for m, column in zip(METRICS, columns):
+        if column:
+            stats["metrics"][m] = column_stats(column)
     return stats
 
 
@@ -68,11 +197,12 @@ def format_stats(stats: dict, header: str = "") -> str:
     lines.append(f"Total records: {stats['total_records']}")
     lines.append(f"Empty answers (scored as 0): {stats['empty_answers']}")
     lines.append("")
-    for m in METRICS:
-        if m in stats["metrics"]:
-            mean = stats["metrics"][m]["mean"]
-            std = stats["metrics"][m]["std"]
-            lines.append(f"{m:<15} mean={mean:.2f}  std={std:.2f}")
+    metrics = stats["metrics"]
+    lines += [
+        f"{m:<15} mean={entry['mean']:.2f}  std={entry['std']:.2f}"
+        for m in METRICS
+        if (entry := metrics.get(m)) is not None
+    ]
     return "\n".join(lines)
 
 
@@ -89,101 +219,148 @@ def aggregate_single(jsonl_file: Path):
     print(f"\nSaved to: {output_file}")
 
 
+def traj_sort_key(name: str) -> tuple:
+    """Sort key putting traj_2 before traj_10; non-numeric suffixes sort last by name."""
+    suffix = name[len("traj_"):]
+    return (0, int(suffix), name) if suffix.isdecimal() else (1, 0, name)
+
+
+def iter_traj_stats(tasks: list):
+    """Yield (traj_dir, stats) for each (traj_dir, jsonl_file) task.
+
+    Trajectories are independent, so several are parsed in parallel and come
+    back in completion order. A single file is parsed in-process, since
+    spawning workers costs more than reading one small score file.
+    """
+    if len(tasks) <= 1:
+        for traj_dir, jsonl_file in tasks:
+            yield traj_dir, aggregate_single_file(jsonl_file)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(len(tasks), os.cpu_count() or 1)) as ex:
+        futures = {ex.submit(aggregate_single_file, jsonl_file): traj_dir for traj_dir, jsonl_file in tasks}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
 def aggregate_multi_trajectory(base_path: Path, target_file: str):
     """Aggregate scores across multiple traj_N subdirectories."""
-    # Find all traj_N directories
-    traj_dirs = sorted([d for d in base_path.iterdir() if d.is_dir() and d.name.startswith("traj_")])
+    # Find all traj_N directories (DirEntry.is_dir() reuses the readdir type)
+    with os.scandir(base_path) as it:
+        traj_dirs = sorted(
+            (Path(e.path) for e in it if e.name.startswith("traj_") and e.is_dir()),
+            key=lambda p: traj_sort_key(p.name),
+        )
 
     if not traj_dirs:
         print(f"No traj_N directories found in {base_path}")
         sys.exit(1)
 
     repo_name = Path(target_file).stem  # e.g., 'django' from 'django.jsonl'
-    all_traj_stats = {}
 
     print(f"Found {len(traj_dirs)} trajectory directories")
     print(f"Target file: {target_file}")
     print()
 
-    # Process each trajectory
+    # Collect the trajectory files that exist
+    # A bare file name can be checked against one directory listing per
+    # trajectory; a target with a directory part needs a real lookup
+    bare_name = Path(target_file).name == target_file
+    tasks = []
     for traj_dir in traj_dirs:
-        traj_name = traj_dir.name
-        jsonl_file = traj_dir / target_file
-
-        if not jsonl_file.exists():
-            print(f"  {traj_name}: {target_file} not found, skipping")
+        if bare_name:
+            with os.scandir(traj_dir) as it:
+                found = target_file in {e.name for e in it}
+        else:
+            found = (traj_dir / target_file).is_file()
+
+        if not found:
+            print(f"  {traj_dir.name}: {target_file} not found, skipping")
             continue
 
-        stats = aggregate_single_file(jsonl_file)
+        tasks.append((traj_dir, traj_dir / target_file))
+
+    # Slots are reserved in directory order so the summary table stays sorted
+    # while results arrive in completion order
+    all_traj_stats = dict.fromkeys(traj_dir.name for traj_dir, _ in tasks)
+
+    # Pool the per-trajectory moments so every record carries the same weight
+    pooled = {m: [0, 0.0, 0.0] for m in METRICS}
+    total_records = 0
+    total_empty = 0
+
+    # Fold each trajectory into the pooled moments as soon as it finishes
+    for traj_dir, stats in iter_traj_stats(tasks):
+        traj_name = traj_dir.name
         all_traj_stats[traj_name] = stats
 
+        total_records += stats["total_records"]
+        total_empty += stats["empty_answers"]
+        for m, entry in stats["metrics"].items():
+            combine_moments(pooled[m], entry)
+
         # Save per-trajectory stats
         traj_output = format_stats(stats, f"Scores for {traj_name}")
         traj_stats_file = traj_dir / f"{repo_name}_score_stats.txt"
         traj_stats_file.write_text(traj_output)
-        print(f"  {traj_name}: mean total={stats['metrics'].get('total_score', {}).get('mean', 0):.2f}, saved to {traj_stats_file.name}")
-
-    # Build overall summary
-    print()
-    overall_lines = [
-        f"Overall Results for {repo_name}",
-        f"Base path: {base_path}",
-        f"Trajectories: {len(all_traj_stats)}",
-        "=" * 60,
-        ""
-    ]
-
-    # Per-trajectory summary table
-    overall_lines.append("Per-Trajectory Summary:")
-    overall_lines.append("-" * 60)
-    overall_lines.append(f"{'Trajectory':<12} {'Records':<8} {'Empty':<6} {'Correctness':<12} {'Total Score':<12}")
-    overall_lines.append("-" * 60)
-
-    for traj_name in sorted(all_traj_stats.keys()):
-        stats = all_traj_stats[traj_name]
-        correctness = stats["metrics"].get("correctness", {}).get("mean", 0)
-        total = stats["metrics"].get("total_score", {}).get("mean", 0)
-        overall_lines.append(
-            f"{traj_name:<12} {stats['total_records']:<8} {stats['empty_answers']:<6} {correctness:<12.2f} {total:<12.2f}"
-        )
-
-    overall_lines.append("")
-    overall_lines.append("")
 
-    # Aggregate across all trajectories
-    overall_lines.append("Aggregate Across All Trajectories:")
-    overall_lines.append("-" * 60)
+    # Report in directory order, whatever order the results arrived in
+    traj_stats_name = f"{repo_name}_score_stats.txt"
+    for traj_name, stats in all_traj_stats.items():
+        print(f"  {traj_name}: mean total={stats['metrics'].get('total_score', {}).get('mean', 0):.2f}, saved to {traj_stats_name}")
 
-    # Combine all scores
-    combined = {m: [] for m in METRICS}
-    total_records = 0
-    total_empty = 0
+    # Write the overall summary line by line, echoing it to stdout
+    print()
+    overall_file = base_path / f"overall_{repo_name}_results.txt"
+    with overall_file.open("w") as out:
+        def emit(line: str = ""):
+            out.write(line)
+            out.write("\n")
+            print(line)
+
+        emit(f"Overall Results for {repo_name}")
+        emit(f"Base path: {base_path}")
+        emit(f"Trajectories: {len(all_traj_stats)}")
+        emit("=" * 60)
+        emit()
+
+        # Per-trajectory summary table
+        emit("Per-Trajectory Summary:")
+        emit("-" * 60)
+        emit(f"{'Trajectory':<12} {'Records':<8} {'Empty':<6} {'Correctness':<12} {'Total Score':<12}")
+        emit("-" * 60)
+
+        # all_traj_stats keys were laid out in directory order, which is already sorted
+        for traj_name, stats in all_traj_stats.items():
+            correctness = stats["metrics"].get("correctness", {}).get("mean", 0)
+            total = stats["metrics"].get("total_score", {}).get("mean", 0)
+            emit(
+                f"{traj_name:<12} {stats['total_records']:<8} {stats['empty_answers']:<6} {correctness:<12.2f} {total:<12.2f}"
+            )
+
+        emit()
+        emit()
+
+        # Aggregate across all trajectories
+        emit("Aggregate Across All Trajectories:")
+        emit("-" * 60)
+        emit(f"Total records across all trajectories: {total_records}")
+        emit(f"Total empty answers: {total_empty}")
+        emit()
+        emit("Pooled over all records:")
+        for m in METRICS:
+            if pooled[m][0]:
+                entry = moment_stats(*pooled[m])
+                emit(f"  {m:<15} mean={entry['mean']:.2f}  std={entry['std']:.2f}")
 
-    for stats in all_traj_stats.values():
-        total_records += stats["total_records"]
-        total_empty += stats["empty_answers"]
+        # Run-to-run spread, which the pooled std over records does not show
+        emit()
+        emit("Std of trajectory means:")
         for m in METRICS:
-            if m in stats["metrics"]:
-                # Weight by number of records (approximate - use mean * count)
-                # Actually, we need the raw values. Let's just average the means for now.
-                combined[m].append(stats["metrics"][m]["mean"])
-
-    overall_lines.append(f"Total records across all trajectories: {total_records}")
-    overall_lines.append(f"Total empty answers: {total_empty}")
-    overall_lines.append("")
-    overall_lines.append("Mean of trajectory means:")
-    for m in METRICS:
-        if combined[m]:
-            mean_of_means = statistics.mean(combined[m])
-            std_of_means = statistics.stdev(combined[m]) if len(combined[m]) > 1 else 0.0
-            overall_lines.append(f"  {m:<15} mean={mean_of_means:.2f}  std={std_of_means:.2f}")
-
-    overall_output = "\n".join(overall_lines)
-
-    # Save overall summary
-    overall_file = base_path / f"overall_{repo_name}_results.txt"
-    overall_file.write_text(overall_output)
-    print(overall_output)
+            means = [stats["metrics"][m]["mean"] for stats in all_traj_stats.values() if m in stats["metrics"]]
+            if means:
+                emit(f"  {m:<15} std={column_stats(means)['std']:.2f}")
+
     print()
     print(f"Overall summary saved to: {overall_file}")
 